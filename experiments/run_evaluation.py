@@ -1,10 +1,19 @@
+import os
 import sys
+import csv
+import time
+import queue
+import atexit
 import logging
+import tempfile
+import multiprocessing
 import hydra
-import pandas as pd
 from pathlib import Path
-from omegaconf import DictConfig
-from typing import List, Tuple, Set
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from omegaconf import DictConfig, OmegaConf
+from typing import List, Tuple, Set, Dict, Optional
 from tqdm import tqdm  # <-- 1. IMPORT TQDM
 
 # --- Project-level Imports ---
@@ -16,6 +25,7 @@ if str(SRC_PATH) not in sys.path:
 try:
     from arcane.agent import ArcaneAgent
     from arcane.baselines import BaselineNaive, BaselineAware
+    from arcane.validator import prepare_shadow_benchmark, SHADOW_ROOT
 except ImportError as e:
     print(f"FATAL: Could not import arcane modules: {e}")
     print("This is likely because you are running from the wrong directory.")
@@ -35,10 +45,21 @@ log = logging.getLogger(__name__)
 RESULTS_FILE = "results.csv"
 JSON_TESTCASES_DIR = "json_testcases"
 PYTHON_PROGRAMS_DIR = "python_programs"
+RESULTS_FLUSH_INTERVAL = 10.0  # Seconds between results.csv flushes
+RESULTS_LINE_TERMINATOR = "\n"  # Matches the existing results.csv; csv defaults to \r\n
 RESULTS_COLUMNS = [
     "agent", "algorithm", "status", "patch", 
     "metrics_before", "metrics_after", "error_message"
 ]
+AGENT_CLASSES = {
+    "ArcaneAgent": ArcaneAgent,
+    "BaselineAware": BaselineAware,
+    "BaselineNaive": BaselineNaive,
+}
+
+# Per-process agent instances and task-start queue, set once by _init_worker
+_worker_agents = {}
+_worker_started = None
 
 def load_benchmark(benchmark_path: Path) -> List[Tuple[str, Path]]:
     """
@@ -52,15 +73,21 @@ def load_benchmark(benchmark_path: Path) -> List[Tuple[str, Path]]:
         log.error(f"Benchmark directories not found at {benchmark_path}")
         return []
 
-    for json_file in json_dir.glob("*.json"):
-        algorithm_name_lower = json_file.stem 
+    # One directory listing each instead of a stat() per candidate file
+    py_names = {entry.name for entry in os.scandir(py_dir) if entry.is_file()}
+    json_names = {
+        entry.name for entry in os.scandir(json_dir)
+        if entry.is_file() and entry.name.endswith(".json")
+    }
+
+    for json_name in sorted(json_names):
+        algorithm_name_lower = json_name[:-len(".json")]
         py_file_name = algorithm_name_lower + ".py"
-        py_file_path = py_dir / py_file_name
         
-        if py_file_path.exists():
-            bugs_to_run.append((algorithm_name_lower, py_file_path))
+        if py_file_name in py_names:
+            bugs_to_run.append((algorithm_name_lower, py_dir / py_file_name))
         else:
-            log.warning(f"Found test {json_file.name} but missing Python file: {py_file_name}")
+            log.warning(f"Found test {json_name} but missing Python file: {py_file_name}")
             
     log.info(f"Found {len(bugs_to_run)} total valid bugs.")
     
@@ -68,33 +95,157 @@ def load_benchmark(benchmark_path: Path) -> List[Tuple[str, Path]]:
     return bugs_to_run
 
 
+def load_bug_sources(bugs: List[Tuple[str, Path]]) -> Dict[str, Optional[str]]:
+    """
+    Reads each bug file once so every agent works from the same source.
+    Unreadable files map to None; the agent then reports FAIL_LOAD itself.
+    """
+    sources = {}
+    for algorithm_name, bug_file_path in bugs:
+        try:
+            sources[algorithm_name] = bug_file_path.read_text(encoding="utf-8")
+        except Exception as e:
+            # Includes UnicodeDecodeError: one bad file must not stop the run
+            log.error(f"Failed to read bug file at {bug_file_path}: {e}")
+            sources[algorithm_name] = None
+    return sources
+
+
+def _write_results_header(results_path: Path):
+    """Creates (or truncates) results.csv with only the header row."""
+    with open(results_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f, lineterminator=RESULTS_LINE_TERMINATOR).writerow(RESULTS_COLUMNS)
+
+
 def load_processed_bugs(results_path: Path) -> Set[Tuple[str, str]]:
     """Loads the results.csv to find which (agent, algorithm) pairs are done."""
-    if not results_path.exists():
-        pd.DataFrame(columns=RESULTS_COLUMNS).to_csv(results_path, index=False)
-        return set()
-        
-    try:
-        df = pd.read_csv(results_path)
-        if df.empty:
-            return set()
-        processed = set(zip(df['agent'], df['algorithm']))
-        log.info(f"Loaded {len(processed)} existing results from {RESULTS_FILE}.")
-        return processed
-    except (pd.errors.EmptyDataError, FileNotFoundError):
+    if not results_path.exists() or os.path.getsize(results_path) == 0:
         log.warning(f"{RESULTS_FILE} is empty or not found. Starting from scratch.")
-        pd.DataFrame(columns=RESULTS_COLUMNS).to_csv(results_path, index=False)
+        _write_results_header(results_path)
         return set()
 
+    # Stream the rows; only the two key columns are kept in memory
+    with open(results_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        processed = {(row['agent'], row['algorithm']) for row in reader}
+
+    log.info(f"Loaded {len(processed)} existing results from {RESULTS_FILE}.")
+    return processed
+
+
+class ResultWriter:
+    """
+    Buffers finished results in memory and appends them to results.csv in
+    batches: every `flush_every` rows or `flush_interval` seconds, whichever
+    comes first. Pending rows are flushed on close, on error and at exit.
+    """
+    def __init__(self, results_path: Path, flush_every: int, flush_interval: float = RESULTS_FLUSH_INTERVAL):
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.pending = deque()
+        self.last_flush = time.monotonic()
+        self.results_file = open(results_path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(
+            self.results_file, fieldnames=RESULTS_COLUMNS, extrasaction='ignore', lineterminator=RESULTS_LINE_TERMINATOR
+        )
+        atexit.register(self.close)
+
+    def save(self, result_data: dict):
+        """Queues a single result, flushing if the batch is due."""
+        self.pending.append(result_data)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flushes if `flush_every` rows are queued or `flush_interval` has passed."""
+        if self.pending and (len(self.pending) >= self.flush_every
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Writes all queued results to results.csv."""
+        if self.results_file.closed:
+            return
+        while self.pending:
+            result_data = self.pending.popleft()
+            try:
+                self.writer.writerow(result_data)
+            except Exception as e:
+                log.error(f"Failed to save result for {result_data.get('algorithm')}: {e}")
+        self.results_file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        """Flushes any queued results and closes results.csv."""
+        self.flush()
+        self.results_file.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _init_worker(cfg_container: dict, benchmark_path: Path, shadow_parent: str, started_queue):
+    """
+    Pool initializer: gives each worker process its own shadow copy of the
+    benchmark and builds one instance of every agent that validates in it.
+    The config is shipped as a plain container so no OmegaConf/Hydra objects
+    have to be pickled across the process boundary.
+    """
+    global _worker_started
+    _worker_started = started_queue
+    # A worker must be able to exit even if its last notices were never read
+    _worker_started.cancel_join_thread()
+    cfg = OmegaConf.create(cfg_container)
+    shadow_dir = prepare_shadow_benchmark(benchmark_path, parent_dir=shadow_parent)
+    for agent_name, agent_class in AGENT_CLASSES.items():
+        _worker_agents[agent_name] = agent_class(cfg, shadow_dir=shadow_dir)
+
+
+def _run_task(agent_name: str, algorithm_name: str, bug_file_path: Path, original_code: Optional[str]) -> dict:
+    """
+    Runs a single (agent, bug) task inside a worker process.
+    Patches are validated in the worker's own shadow benchmark, so tasks on
+    the same bug can run concurrently.
+    """
+    log.info(f"========== Processing Bug: {algorithm_name} | Agent: {agent_name} ==========")
+    _worker_started.put((agent_name, algorithm_name))
+    agent = _worker_agents[agent_name]
 
-def save_result(results_path: Path, result_data: dict):
-    """Appends a single result to the results.csv file."""
     try:
-        complete_data = {col: result_data.get(col) for col in RESULTS_COLUMNS}
-        new_row_df = pd.DataFrame([complete_data])
-        new_row_df.to_csv(results_path, mode='a', header=False, index=False)
+        return agent.run_fix(bug_file_path, algorithm_name, original_code=original_code)
     except Exception as e:
-        log.error(f"Failed to save result for {result_data.get('algorithm')}: {e}")
+        # Catch any critical errors during an agent's run
+        log.error(f"CRITICAL ERROR running {agent_name} on {algorithm_name}: {e}", exc_info=True)
+        return {
+            "agent": agent_name, 
+            "algorithm": algorithm_name, 
+            "status": "CRASH"
+        }
+
+
+def _drain_started(started_queue, started: Set[Tuple[str, str]]):
+    """Moves the (agent, algorithm) start notices sent by the workers into `started`."""
+    while True:
+        try:
+            started.add(started_queue.get_nowait())
+        except queue.Empty:
+            return
+
+
+def _terminate_workers(executor: ProcessPoolExecutor):
+    """
+    Kills the pool's worker processes so abandoned tasks stop running, then
+    shuts the pool down. shutdown() alone would wait for the stuck tasks.
+    """
+    if hasattr(executor, "terminate_workers"):  # Python 3.14+
+        executor.terminate_workers()
+        return
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=True, cancel_futures=True)
 
 
 @hydra.main(config_path="../configs", config_name="config", version_base=None)
@@ -114,53 +265,129 @@ def run_evaluation(cfg: DictConfig):
     all_bugs = load_benchmark(benchmark_path)
     processed_bugs = load_processed_bugs(results_path)
     
-    agents = [
-        ArcaneAgent(cfg),
-        BaselineAware(cfg),
-        BaselineNaive(cfg)
-    ]
-    
     # --- 2. BUILD THE MASTER TASK LIST ---
     # Create a master list of all (bug, agent) pairs
     all_tasks = [
-        (algorithm_name, bug_file_path, agent)
+        (algorithm_name, bug_file_path, agent_name)
         for (algorithm_name, bug_file_path) in all_bugs
-        for agent in agents
+        for agent_name in AGENT_CLASSES
     ]
     
     # Filter out tasks that are already processed
     tasks_to_run = []
-    for algorithm_name, bug_file_path, agent in all_tasks:
-        if (agent.agent_name, algorithm_name) in processed_bugs:
-            log.info(f"Skipping {agent.agent_name} for {algorithm_name} (already processed).")
+    for algorithm_name, bug_file_path, agent_name in all_tasks:
+        if (agent_name, algorithm_name) in processed_bugs:
+            log.info(f"Skipping {agent_name} for {algorithm_name} (already processed).")
         else:
-            tasks_to_run.append((algorithm_name, bug_file_path, agent))
+            tasks_to_run.append((algorithm_name, bug_file_path, agent_name))
             
     log.info(f"Total tasks: {len(all_tasks)}. Remaining tasks: {len(tasks_to_run)}")
+
+    pending_bugs = {algorithm_name: bug_file_path for algorithm_name, bug_file_path, _ in tasks_to_run}
+    bug_sources = load_bug_sources(list(pending_bugs.items()))
     
-    # --- 3. RUN THE MAIN LOOP WITH TQDM ---
-    # Wrap 'tasks_to_run' with tqdm for a progress bar
-    for algorithm_name, bug_file_path, agent in tqdm(tasks_to_run, desc="Overall Experiment Progress"):
-        
-        log.info(f"========== Processing Bug: {algorithm_name} | Agent: {agent.agent_name} ==========")
-        agent_name = agent.agent_name
-        
-        try:
-            # Run the full fix/validation loop
-            result = agent.run_fix(bug_file_path, algorithm_name)
-            
-            # Save the result immediately
-            save_result(results_path, result)
-            
-        except Exception as e:
-            # Catch any critical errors during an agent's run
-            log.error(f"CRITICAL ERROR running {agent_name} on {algorithm_name}: {e}", exc_info=True)
-            result = {
-                "agent": agent_name, 
-                "algorithm": algorithm_name, 
-                "status": "CRASH"
-            }
-            save_result(results_path, result)
+    # --- 3. RUN THE TASKS ON A PROCESS POOL ---
+    cfg_container = OmegaConf.to_container(cfg, resolve=True)
+
+    results = ResultWriter(results_path, flush_every=len(tasks_to_run) // 20)
+
+    # Worker shadow copies live under one directory removed at the end of the run
+    shadow_parent = tempfile.TemporaryDirectory(prefix="arcane_", dir=SHADOW_ROOT, ignore_cleanup_errors=True)
+
+    # Workers report each task as it starts, so a stall can tell running
+    # tasks apart from ones that were only queued
+    started_queue = multiprocessing.Queue()
+    started = set()
+    stalled = False
+
+    with results, shadow_parent:
+        executor = ProcessPoolExecutor(
+            max_workers=cfg.run.workers,
+            initializer=_init_worker,
+            initargs=(cfg_container, benchmark_path, shadow_parent.name, started_queue)
+        )
+        futures = {
+            executor.submit(
+                _run_task, agent_name, algorithm_name, bug_file_path,
+                bug_sources[algorithm_name]
+            ): (algorithm_name, agent_name)
+            for algorithm_name, bug_file_path, agent_name in tasks_to_run
+        }
+
+        pending = set(futures)
+        # Wake up at least every flush interval so queued rows reach disk even
+        # while no task finishes; the stall deadline is tracked separately
+        poll_interval = min(cfg.run.task_timeout, results.flush_interval)
+        last_progress = time.monotonic()
+        with tqdm(total=len(futures), desc="Overall Experiment Progress") as progress:
+            while pending:
+                done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                _drain_started(started_queue, started)
+                results.flush_if_due()
+
+                if done:
+                    last_progress = time.monotonic()
+                elif time.monotonic() - last_progress >= cfg.run.task_timeout:
+                    # No task finished within the timeout: the pool is stuck.
+                    # Only tasks that were running are recorded as TIMEOUT; the
+                    # ones that never started are left for the next run.
+                    log.error(f"No task completed in {cfg.run.task_timeout}s. Stopping the workers.")
+                    for future in pending:
+                        algorithm_name, agent_name = futures[future]
+                        if (agent_name, algorithm_name) not in started:
+                            continue
+                        log.error(f"Task timed out: {agent_name} on {algorithm_name}")
+                        results.save({
+                            "agent": agent_name,
+                            "algorithm": algorithm_name,
+                            "status": "TIMEOUT"
+                        })
+                    stalled = True
+                    break
+
+                broken = []
+                for future in done:
+                    algorithm_name, agent_name = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # A worker died or failed to initialize; handled below
+                        broken.append(future)
+                        continue
+                    except Exception as e:
+                        log.error(f"CRITICAL ERROR running {agent_name} on {algorithm_name}: {e}")
+                        result = {
+                            "agent": agent_name, 
+                            "algorithm": algorithm_name, 
+                            "status": "CRASH"
+                        }
+                    # Results are written only from the main process
+                    results.save(result)
+                    progress.update(1)
+
+                if broken:
+                    # A broken pool fails every outstanding task, including the
+                    # ones only queued. As with a stall, only tasks that were
+                    # running are recorded (as CRASH); the rest are left for
+                    # the next run.
+                    log.error("The worker pool broke (a worker died or failed to start). Stopping the run.")
+                    for future in broken + list(pending):
+                        algorithm_name, agent_name = futures[future]
+                        if (agent_name, algorithm_name) not in started:
+                            continue
+                        log.error(f"Task crashed: {agent_name} on {algorithm_name}")
+                        results.save({
+                            "agent": agent_name,
+                            "algorithm": algorithm_name,
+                            "status": "CRASH"
+                        })
+                    break
+
+        # Stop the workers before their shadow copies are removed
+        if stalled:
+            _terminate_workers(executor)
+        else:
+            executor.shutdown(wait=True)
 
     log.info("========== Evaluation Complete ==========")
     log.info(f"All results saved to: {results_path}")
@@ -1,9 +1,11 @@
 import logging
 from pathlib import Path
+from typing import Optional
 
 # Import our custom modules
-from .planning import run_plan, run_retry_plan
-from .validator import run_validation, PASS
+from .planning import run_plan, run_retry_plan, load_prompt_templates
+from .validator import run_validation, PASS, RETRYABLE
+from .utils import read_bug_file
 
 log = logging.getLogger(__name__)
 
@@ -13,23 +15,27 @@ class ArcaneAgent:
     """
     The main agent class that orchestrates the retry loop (Python-only).
     """
-    def __init__(self, config):
+    def __init__(self, config, shadow_dir: Optional[Path] = None):
         self.config = config
+        self.shadow_dir = shadow_dir # Benchmark copy to validate in, if any
+        self.prompts = load_prompt_templates(config)
         self.agent_name = "ArcaneAgent"
         log.info("ArcaneAgent initialized (Retry-Loop-Only).")
 
-    def run_fix(self, bug_path: Path, algorithm_name: str):
+    def run_fix(self, bug_path: Path, algorithm_name: str, original_code: Optional[str] = None):
         """
         Runs the full Monitor-Plan-Execute (MPE) retry loop on a single bug.
         """
         log.info(f"===== Starting ARCANE run for: {algorithm_name} =====")
         
         # --- MONITOR (M) ---
-        try:
-            original_code = bug_path.read_text(encoding="utf-8")
-        except Exception as e:
-            log.error(f"Failed to read bug file at {bug_path}: {e}")
-            return self._create_result(algorithm_name, "FAIL_LOAD")
+        # The caller may pass in the source it already read for this bug
+        if original_code is None:
+            try:
+                original_code = read_bug_file(bug_path)
+            except Exception as e:
+                log.error(f"Failed to read bug file at {bug_path}: {e}")
+                return self._create_result(algorithm_name, "FAIL_LOAD")
 
         # --- PLAN (P) & EXECUTE (E) LOOP ---
         current_patch = None
@@ -40,14 +46,14 @@ class ArcaneAgent:
             log.info(f"Starting attempt {attempt + 1}/{MAX_RETRIES} for {algorithm_name}...")
             
             if attempt == 0:
-                current_patch = run_plan(original_code, metrics_json=None, config=self.config)
+                current_patch = run_plan(original_code, metrics_json=None, prompts=self.prompts)
             else:
                 log.info(f"Retrying with error context: {error_message}")
                 current_patch = run_retry_plan(
                     original_code, 
                     current_patch,
                     error_message, 
-                    self.config
+                    self.prompts
                 )
 
             if not current_patch:
@@ -56,13 +62,16 @@ class ArcaneAgent:
                 continue 
 
             # --- EXECUTE (E) ---
-            status, error = run_validation(current_patch, str(bug_path), algorithm_name)
+            status, error = run_validation(current_patch, str(bug_path), algorithm_name, self.shadow_dir)
             validation_status = status
             error_message = error
 
             if status == PASS:
                 log.info(f"SUCCESS! Patch passed validation on attempt {attempt + 1}.")
                 break
+            elif status not in RETRYABLE:
+                log.error(f"Attempt {attempt + 1} failed with non-retryable status {status}. Stopping.")
+                break
             else:
                 log.warning(f"Attempt {attempt + 1} failed. Status: {status}.")
         
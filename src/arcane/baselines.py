@@ -1,22 +1,29 @@
 import logging
 from pathlib import Path
 from abc import ABC, abstractmethod
-from typing import Optional # <-- Added import
+from typing import Optional, List, Tuple # <-- Added import
+from concurrent.futures import ThreadPoolExecutor
 
 # Import our custom modules
 from .validator import run_validation, PASS
+from .utils import extract_code_block, read_bug_file
 from .planning import run_plan as run_aware_plan
-from .planning import client as openai_client
+from .planning import load_prompt_templates
+from .planning import chat_completion, CODE_BLOCK_END
 
 log = logging.getLogger(__name__)
 
+NAIVE_SYSTEM_PROMPT = "You are a helpful coding assistant."
+
 
 class BaseBaselineAgent(ABC):
     """
     Abstract base class for all baseline agents.
     """
-    def __init__(self, config):
+    def __init__(self, config, shadow_dir: Optional[Path] = None):
         self.config = config
+        self.shadow_dir = shadow_dir # Benchmark copy to validate in, if any
+        self.prompts = load_prompt_templates(config)
         self.agent_name = "BaseAgent"
     
     @abstractmethod
@@ -24,15 +31,17 @@ class BaseBaselineAgent(ABC):
         """The-subclass-specific method for generating a patch."""
         pass
     
-    def run_fix(self, bug_path: Path, algorithm_name: str):
+    def run_fix(self, bug_path: Path, algorithm_name: str, original_code: Optional[str] = None):
         """Runs the full fix and validation process."""
         log.info(f"===== Starting {self.agent_name} run for: {algorithm_name} =====")
         
-        try:
-            original_code = bug_path.read_text(encoding="utf-8")
-        except Exception as e:
-            log.error(f"Failed to read bug file at {bug_path}: {e}")
-            return self._create_result(algorithm_name, "FAIL_LOAD")
+        # The caller may pass in the source it already read for this bug
+        if original_code is None:
+            try:
+                original_code = read_bug_file(bug_path)
+            except Exception as e:
+                log.error(f"Failed to read bug file at {bug_path}: {e}")
+                return self._create_result(algorithm_name, "FAIL_LOAD")
 
         patch_code = self._get_patch(original_code)
         
@@ -40,7 +49,7 @@ class BaseBaselineAgent(ABC):
             log.error(f"{self.agent_name} plan failed to generate a patch.")
             return self._create_result(algorithm_name, "FAIL_PLAN")
 
-        validation_status, error_message = run_validation(patch_code, str(bug_path), algorithm_name)
+        validation_status, error_message = run_validation(patch_code, str(bug_path), algorithm_name, self.shadow_dir)
         
         if validation_status == PASS:
             error_message = None
@@ -52,6 +61,32 @@ class BaseBaselineAgent(ABC):
             error_message
         )
 
+    def run_fix_batch(self, items: List[Tuple[Path, str]], max_workers: int = 8) -> List[dict]:
+        """
+        Runs `run_fix` for many (bug_path, algorithm_name) pairs on a thread pool.
+        The work is dominated by network I/O, so threads overlap the waits.
+        Validation patches the bug file in place, so items for the same file
+        are run one after another in a single thread; different bugs run
+        concurrently. Results are returned in the same order as `items`.
+        """
+        results = [None] * len(items)
+        groups = {}
+        for index, (bug_path, _) in enumerate(items):
+            groups.setdefault(Path(bug_path).resolve(), []).append(index)
+
+        def run_group(indices: List[int]):
+            for index in indices:
+                bug_path, algorithm_name = items[index]
+                try:
+                    results[index] = self.run_fix(bug_path, algorithm_name)
+                except Exception as e:
+                    log.error(f"CRITICAL ERROR running {self.agent_name} on {algorithm_name}: {e}", exc_info=True)
+                    results[index] = self._create_result(algorithm_name, "CRASH")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(run_group, groups.values()))
+        return results
+
     def _create_result(self, algo_name, status, patch=None, error=None):
         """Helper to format the final result dictionary."""
         return {
@@ -69,36 +104,22 @@ class BaselineNaive(BaseBaselineAgent):
     """
     A "naive" baseline agent (B1).
     """
-    def __init__(self, config):
-        super().__init__(config)
+    def __init__(self, config, shadow_dir: Optional[Path] = None):
+        super().__init__(config, shadow_dir)
         self.agent_name = "BaselineNaive"
         log.info(f"{self.agent_name} initialized.")
     
     def _get_patch(self, original_code: str) -> Optional[str]:
-        if not openai_client:
-            log.error("OpenAI client not initialized.")
-            return None
         try:
             prompt_content = f"Fix the bug in the following Python code. Only return the full, corrected code block.\n\n```python\n{original_code}\n```"
             
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a helpful coding assistant."},
-                    {"role": "user", "content": prompt_content}
-                ],
-                temperature=0.2,
+            content = chat_completion(
+                NAIVE_SYSTEM_PROMPT, prompt_content, temperature=0.2, stop_after=CODE_BLOCK_END
             )
-            content = response.choices[0].message.content
+            if not content:
+                return None
             
-            if "```" in content:
-                parts = content.split("```")
-                if len(parts) > 1:
-                    code_block = parts[1]
-                    if code_block.lower().startswith("python\n"):
-                        code_block = code_block[7:]
-                    return code_block.strip()
-            return content.strip()
+            return extract_code_block(content)
 
         except Exception as e:
             log.error(f"OpenAI API call failed for NaiveBaseline: {e}")
@@ -109,10 +130,10 @@ class BaselineAware(BaseBaselineAgent):
     """
     An "architecturally-aware" baseline agent (B2).
     """
-    def __init__(self, config):
-        super().__init__(config)
+    def __init__(self, config, shadow_dir: Optional[Path] = None):
+        super().__init__(config, shadow_dir)
         self.agent_name = "BaselineAware"
         log.info(f"{self.agent_name} initialized.")
     
     def _get_patch(self, original_code: str) -> Optional[str]:
-        return run_aware_plan(original_code, metrics_json=None, config=self.config)
\ No newline at end of file
+        return run_aware_plan(original_code, metrics_json=None, prompts=self.prompts)
\ No newline at end of file
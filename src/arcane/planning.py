@@ -1,45 +1,145 @@
 import os
 import re
+import json
+import hashlib
 import logging
-from typing import Optional  # <-- This was the missing import
-from openai import OpenAI
+import difflib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, NamedTuple, TYPE_CHECKING  # <-- This was the missing import
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+from .utils import PROJECT_ROOT, extract_code_block
+
 load_dotenv()
 log = logging.getLogger(__name__)
 
-try:
-    client = OpenAI()
-except Exception as e:
-    log.error(f"Failed to initialize OpenAI client. Is OPENAI_API_KEY set? Error: {e}")
-    client = None
+MODEL_NAME = "gpt-4o"
+REQUEST_TIMEOUT = 120.0 # Seconds an OpenAI request may take (per attempt)
+PLANNER_SYSTEM_PROMPT = "You are a 10x Staff Engineer specialized in code security and maintainability."
+
+# Completed LLM responses, persisted as JSON lines so resumed runs reuse them.
+# ARCANE_CACHE_MODE controls how the cache is used:
+#   off (default) - bypass the cache entirely
+#   replay        - serve cached responses, call the API and record on a miss
+#   read          - serve cached responses, never record new ones (offline)
+#   write         - always call the API and record (refreshes the cache)
+# Responses are sampled (temperature > 0) and the cache is shared by all
+# agents, so any mode that serves cached responses replays earlier samples
+# instead of drawing new ones.
+CACHE_DIR = PROJECT_ROOT / ".arcane_cache"
+RESPONSE_CACHE_FILE = CACHE_DIR / "llm_responses.jsonl"
+CACHE_MODES = {"off", "read", "write", "replay"}
+CACHE_MODE = os.environ.get("ARCANE_CACHE_MODE", "off").lower()
+if CACHE_MODE not in CACHE_MODES:
+    log.warning(f"Unknown ARCANE_CACHE_MODE '{CACHE_MODE}'. Falling back to 'off'.")
+    CACHE_MODE = "off"
+_response_cache = None
+
+# Streamed responses stop once `marker` has been seen `count` times; the rest
+# of the generation is not needed to extract the patch.
+CODE_BLOCK_END = ("```", 2)
+PATCH_BLOCK_END = ("</patch>", 1)
+
+PATCH_RE = re.compile(r"<patch>(.*?)</patch>", re.DOTALL | re.IGNORECASE)
 
-def run_plan(code: str, metrics_json: str, config):
+# Speculative Plan-2 (opt-in, planning.speculative_plan_2): while Plan-1 runs,
+# Plan-2 is started with the strategy last produced for the same code, and kept
+# if the new strategy is close enough. A rejected speculation is still billed.
+SPECULATION_SIMILARITY = 0.9
+_speculation_pool = ThreadPoolExecutor(max_workers=2)
+_last_strategy = {}
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> Optional["OpenAI"]:
+    """Returns the process-wide OpenAI client, creating it on first use."""
+    try:
+        # Imported lazily: openai pulls in httpx/pydantic, which most CLI paths never need
+        from openai import OpenAI
+        return OpenAI(timeout=REQUEST_TIMEOUT)
+    except Exception as e:
+        log.error(f"Failed to initialize OpenAI client. Is OPENAI_API_KEY set? Error: {e}")
+        return None
+
+class PromptTemplates(NamedTuple):
+    """
+    Plain-string snapshot of the Hydra prompt templates, plus the `planning`
+    options that decide how they are used.
+    """
+    plan_1: str
+    plan_2: str
+    retry: str
+    plan_2_no_metrics: Optional[str] = None  # Set only when the brainstorm may be skipped
+    speculative_plan_2: bool = False  # planning.speculative_plan_2
+
+
+def load_prompt_templates(config) -> PromptTemplates:
+    """Copies the prompt templates and planning options out of the config once, at agent construction."""
+    planning = config.get("planning") or {}
+    skip_brainstorm = planning.get("skip_brainstorm_without_metrics", False)
+    return PromptTemplates(
+        plan_1=str(config.prompts.plan_1),
+        plan_2=str(config.prompts.plan_2),
+        retry=str(config.prompts.prompt_plan_3_retry),
+        plan_2_no_metrics=str(config.prompts.plan_2_no_metrics) if skip_brainstorm else None,
+        speculative_plan_2=bool(planning.get("speculative_plan_2", False))
+    )
+
+
+def run_plan(code: str, metrics_json: str, prompts: PromptTemplates):
     """
     Generates a patch using the two-step "Chain of Thought" (CoT) plan.
     This is used for the FIRST attempt.
     """
-    if not client:
-        log.error("OpenAI client not initialized. Cannot run plan.")
-        return None
+    if metrics_json is None and prompts.plan_2_no_metrics:
+        return _run_single_shot_plan(code, prompts)
 
     log.info("--- 2. PLAN (Attempt 1): Starting 2-step patch generation ---")
 
     try:
-        prompt_1 = config.prompts.plan_1.format(
+        prompt_1 = prompts.plan_1.format(
             baseline_metrics_json=metrics_json or "N/A", # Will be N/A
             vulnerable_code=code
         )
+
+        # Kick off Plan-2 with the previous strategy for this code, if any.
+        # A cached Plan-1 returns at once, so there is no latency to hide.
+        code_key = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        cached_strategy = _last_strategy.get(code_key)
+        speculative_patch = None
+        if (prompts.speculative_plan_2 and cached_strategy
+                and _cached_response(PLANNER_SYSTEM_PROMPT, prompt_1, 0.2) is None):
+            speculative_patch = _speculation_pool.submit(
+                _call_openai_api,
+                prompts.plan_2.format(
+                    vulnerable_code=code,
+                    strategy_analysis_text=cached_strategy
+                ),
+                extract_code=True
+            )
+
         strategy_analysis = _call_openai_api(prompt_1)
         
         if not strategy_analysis:
             raise Exception("Plan Step 1 (Brainstorming) failed.")
+        _last_strategy[code_key] = strategy_analysis
 
-        prompt_2 = config.prompts.plan_2.format(
-            vulnerable_code=code,
-            strategy_analysis_text=strategy_analysis
-        )
-        generated_patch = _call_openai_api(prompt_2, extract_code=True)
+        generated_patch = None
+        if speculative_patch and _is_similar_strategy(strategy_analysis, cached_strategy):
+            log.info("Strategy unchanged. Using speculative Plan Step 2 result.")
+            generated_patch = speculative_patch.result()
+        elif speculative_patch:
+            speculative_patch.cancel()
+
+        if not generated_patch:
+            prompt_2 = prompts.plan_2.format(
+                vulnerable_code=code,
+                strategy_analysis_text=strategy_analysis
+            )
+            generated_patch = _call_openai_api(prompt_2, extract_code=True)
 
         if not generated_patch:
             raise Exception("Plan Step 2 (Final Generation) failed.")
@@ -52,25 +152,53 @@ def run_plan(code: str, metrics_json: str, config):
         return None
 
 
-def run_retry_plan(original_code: str, failed_patch: str, error_message: str, config):
+def _run_single_shot_plan(code: str, prompts: PromptTemplates):
+    """
+    Generates a patch in one call when there are no metrics to brainstorm over.
+    """
+    log.info("--- 2. PLAN (Attempt 1): Starting single-shot patch generation (no metrics) ---")
+
+    try:
+        prompt = prompts.plan_2_no_metrics.format(vulnerable_code=code)
+        generated_patch = _call_openai_api(prompt, extract_code=True)
+
+        if not generated_patch:
+            raise Exception("Single-shot plan failed.")
+
+        log.info("--- PLAN (Attempt 1) complete. Generated patch. ---")
+        return generated_patch
+
+    except Exception as e:
+        log.error(f"An unexpected error occurred during planning: {e}")
+        return None
+
+
+def _is_similar_strategy(new: str, cached: str) -> bool:
+    """True if two Plan-1 strategies are close enough to share a Plan-2 result."""
+    if new == cached:
+        return True
+    matcher = difflib.SequenceMatcher(None, new, cached)
+    # The quick ratios are cheap upper bounds; only pay for ratio() if they pass
+    return (matcher.real_quick_ratio() > SPECULATION_SIMILARITY
+            and matcher.quick_ratio() > SPECULATION_SIMILARITY
+            and matcher.ratio() > SPECULATION_SIMILARITY)
+
+
+def run_retry_plan(original_code: str, failed_patch: str, error_message: str, prompts: PromptTemplates):
     """
     Generates a new patch using the "Chain-of-Thought (CoT) retry" logic.
     This is used for attempts 2 and 3.
     """
-    if not client:
-        log.error("OpenAI client not initialized. Cannot run retry_plan.")
-        return None
-    
     log.info("--- 2. PLAN (Retry): Starting CoT error correction plan ---")
 
     try:
-        prompt_3 = config.prompts.prompt_plan_3_retry.format(
+        prompt_3 = prompts.retry.format(
             vulnerable_code=original_code,
             failed_patch=failed_patch or "N/A",
             error_message=error_message
         )
         
-        full_cot_response = _call_openai_api(prompt_3, temperature=0.3)
+        full_cot_response = _call_openai_api(prompt_3, temperature=0.3, stop_after=PATCH_BLOCK_END)
         
         if not full_cot_response:
             raise Exception("Retry Plan failed to return any content.")
@@ -89,24 +217,125 @@ def run_retry_plan(original_code: str, failed_patch: str, error_message: str, co
         return None
 
 
-def _call_openai_api(prompt_content: str, extract_code: bool = False, temperature: float = 0.2):
+@functools.lru_cache(maxsize=1)
+def _log_cache_mode():
+    """Logs the response cache mode once per process, on the first request."""
+    log.info(f"LLM response cache mode: {CACHE_MODE} (set ARCANE_CACHE_MODE to change)")
+
+
+def _load_response_cache() -> dict:
+    """Loads the on-disk response cache into memory on first use."""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = {}
+        if RESPONSE_CACHE_FILE.exists():
+            with open(RESPONSE_CACHE_FILE, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Partially written line from an interrupted run
+                    _response_cache[entry["key"]] = entry["content"]
+    return _response_cache
+
+
+def _response_cache_key(system_prompt: str, prompt_content: str, temperature: float) -> str:
+    """Cache key covering everything that is sent with a chat request."""
+    request = {"model": MODEL_NAME, "sys": system_prompt, "user": prompt_content, "t": temperature}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _store_response(key: str, content: str):
+    """Records a response in memory and appends it to the on-disk cache."""
+    _load_response_cache()[key] = content
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(RESPONSE_CACHE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "content": content}) + "\n")
+    except OSError as e:
+        log.warning(f"Could not persist LLM response to cache: {e}")
+
+
+def _cached_response(system_prompt: str, prompt_content: str, temperature: float) -> Optional[str]:
+    """Returns the cached response for this request, if the cache mode serves one."""
+    if CACHE_MODE not in ("read", "replay"):
+        return None
+    return _load_response_cache().get(_response_cache_key(system_prompt, prompt_content, temperature))
+
+
+def chat_completion(system_prompt: str, prompt_content: str, temperature: float = 0.2,
+                    stop_after: Optional[tuple] = None) -> Optional[str]:
+    """
+    Sends one chat request, going through the response cache according to
+    ARCANE_CACHE_MODE. Returns the raw response text, or None if it was empty.
+    The response is streamed; with `stop_after=(marker, count)` reading stops
+    as soon as the marker has appeared `count` times (case-insensitive).
+    The OpenAI client is only needed on a cache miss.
+    """
+    _log_cache_mode()
+    content = _cached_response(system_prompt, prompt_content, temperature)
+    if content is not None:
+        log.info("Using cached LLM response.")
+        return content
+
+    client = get_client()
+    if client is None:
+        raise RuntimeError("OpenAI client not initialized and no cached response for this request.")
+
+    stream = client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt_content}
+        ],
+        temperature=temperature,
+        stream=True,
+    )
+    content = _read_stream(stream, stop_after)
+
+    if content and CACHE_MODE in ("write", "replay"):
+        _store_response(_response_cache_key(system_prompt, prompt_content, temperature), content)
+    return content
+
+
+def _read_stream(stream, stop_after: Optional[tuple]) -> str:
+    """Accumulates streamed deltas, stopping early once `stop_after` is met."""
+    marker, needed = stop_after if stop_after else (None, 0)
+    content = ""
+    seen = 0
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+
+            # Only the new text (plus any marker split across chunks) is scanned
+            window_start = max(0, len(content) - len(marker) + 1) if marker else 0
+            content += delta
+            if marker:
+                seen += content[window_start:].lower().count(marker)
+                if seen >= needed:
+                    break
+    finally:
+        stream.close()
+    return content
+
+
+def _call_openai_api(prompt_content: str, extract_code: bool = False, temperature: float = 0.2,
+                     stop_after: Optional[tuple] = None):
     """Helper function to call the OpenAI API."""
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a 10x Staff Engineer specialized in code security and maintainability."},
-                {"role": "user", "content": prompt_content}
-            ],
-            temperature=temperature,
-        )
-        content = response.choices[0].message.content
+        if extract_code and stop_after is None:
+            stop_after = CODE_BLOCK_END
+        content = chat_completion(PLANNER_SYSTEM_PROMPT, prompt_content, temperature, stop_after)
         
         if not content:
             return None
         
         if extract_code:
-            return _extract_simple_patch(content)
+            return extract_code_block(content)
         else:
             return content.strip()
 
@@ -115,29 +344,16 @@ def _call_openai_api(prompt_content: str, extract_code: bool = False, temperatur
         return None
 
 
-def _extract_simple_patch(content: str) -> Optional[str]:
-    """Extracts a simple ```python ... ``` block."""
-    if "```" in content:
-        parts = content.split("```")
-        if len(parts) > 1:
-            code_block = parts[1]
-            if code_block.lower().startswith("python\n"):
-                code_block = code_block[7:]
-            return code_block.strip()
-    log.warning("No ``` code block found in API response. Returning raw content.")
-    return content.strip()
-
-
 def _extract_cot_patch(content: str) -> Optional[str]:
     """Extracts the <patch>...</patch> block from a CoT response."""
     try:
-        match = re.search(r"<patch>(.*?)</patch>", content, re.DOTALL | re.IGNORECASE)
+        match = PATCH_RE.search(content)
         if match:
             patch_content = match.group(1).strip()
-            return _extract_simple_patch(patch_content)
+            return extract_code_block(patch_content)
         
         log.warning("No <patch> block found. Falling back to simple extraction.")
-        return _extract_simple_patch(content)
+        return extract_code_block(content)
         
     except Exception as e:
         log.error(f"Error during CoT patch extraction: {e}")
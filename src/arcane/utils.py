@@ -1,48 +1,135 @@
 import os
+import shutil
+import hashlib
+import functools
+import threading
 import subprocess
 import logging
-import requests
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 log = logging.getLogger(__name__)
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+BENCHMARK_DIR = PROJECT_ROOT / "data" / "benchmarks" / "QuixBugs"
 # Create a 'junit_libs' folder to hold our downloaded JARs
-JUNIT_DIR = PROJECT_ROOT / "data" / "benchmarks" / "QuixBugs" / "java_testcases" / "junit_libs"
+JUNIT_DIR = BENCHMARK_DIR / "java_testcases" / "junit_libs"
 JUNIT_PATH = JUNIT_DIR / "junit-4.12.jar"
 HAMCREST_PATH = JUNIT_DIR / "hamcrest-core-1.3.jar"
 
 JUNIT_URL = "https://repo1.maven.org/maven2/junit/junit/4.12/junit-4.12.jar"
 HAMCREST_URL = "https://repo1.maven.org/maven2/org/hamcrest/hamcrest-core/1.3/hamcrest-core-1.3.jar"
+# Published sizes (bytes) and SHA-1 digests from Maven Central, used to
+# spot truncated or corrupted downloads
+JUNIT_SIZE = 314932
+JUNIT_SHA1 = "2973d150c0dc1fefe998f834810d68f278ea58ec"
+HAMCREST_SIZE = 45024
+HAMCREST_SHA1 = "42a25dc3219429f0e5d060061f71acb49bf010a0"
 
-def _download_jar(url: str, path: Path):
-    """Downloads a JAR file if it's missing."""
-    if path.exists():
-        log.info(f"{path.name} already exists.")
-        return
+# Set once the JARs are verified, so the hot validation path skips the
+# checks afterwards
+_deps_ok = False
+_deps_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=128)
+def _read_bug_cached(path_str: str, mtime_ns: int, size: int) -> str:
+    return Path(path_str).read_text(encoding="utf-8")
+
+def read_bug_file(path: Path) -> str:
+    """
+    Reads a bug file, memoized on (path, mtime, size) so repeated reads of an
+    unchanged file skip the open/read/decode.
+    """
+    st = path.stat()
+    return _read_bug_cached(str(path), st.st_mtime_ns, st.st_size)
 
-    log.warning(f"{path.name} not found. Downloading...")
+def extract_code_block(content: str) -> str:
+    """
+    Extracts the first ``` fenced block from an LLM response, dropping a
+    leading "python" language tag. Returns the stripped raw content if
+    there is no fence; an unterminated fence runs to the end of the text.
+    """
+    start = content.find("```")
+    if start == -1:
+        log.warning("No ``` code block found in API response. Returning raw content.")
+        return content.strip()
+
+    end = content.find("```", start + 3)
+    code_block = content[start + 3:end] if end != -1 else content[start + 3:]
+    if code_block[:7].lower() == "python\n":
+        code_block = code_block[7:]
+    return code_block.strip()
+
+def _jar_is_complete(path: Path, expected_size: int, expected_sha1: str) -> bool:
+    """True if the JAR exists and matches its published size and SHA-1."""
+    if not path.exists() or path.stat().st_size != expected_size:
+        return False
+    return hashlib.sha1(path.read_bytes()).hexdigest() == expected_sha1
+
+def _download_jar(session, url: str, path: Path, expected_sha1: str):
+    """
+    Downloads a JAR file over the shared session into a .part file, verifies
+    it, and only then moves it into place, so a failed download never leaves
+    a broken JAR behind.
+    """
+    log.warning(f"{path.name} missing or corrupted. Downloading...")
+    part_file = path.with_suffix(".part")
     try:
         JUNIT_DIR.mkdir(parents=True, exist_ok=True)
-        response = requests.get(url, stream=True)
+        response = session.get(url, stream=True, headers={"Accept-Encoding": "identity"})
         response.raise_for_status()
 
-        with open(path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        with open(part_file, "wb") as f:
+            shutil.copyfileobj(response.raw, f, length=65536)
+
+        sha1 = hashlib.sha1(part_file.read_bytes()).hexdigest()
+        if sha1 != expected_sha1:
+            raise ValueError(f"SHA-1 mismatch (expected {expected_sha1}, got {sha1})")
+
+        os.replace(part_file, path)
         log.info(f"Successfully downloaded {path.name}.")
 
     except Exception as e:
+        part_file.unlink(missing_ok=True)
         log.error(f"FATAL: Failed to download {path.name}: {e}")
         raise e
 
 def _ensure_dependencies():
     """Ensures all required .jar files are downloaded."""
-    _download_jar(JUNIT_URL, JUNIT_PATH)
-    _download_jar(HAMCREST_URL, HAMCREST_PATH)
+    global _deps_ok
+    if _deps_ok:
+        return
+
+    with _deps_lock:
+        if _deps_ok:
+            return  # Another thread finished the setup while we waited
 
+        missing = [
+            (url, path, sha1) for url, path, size, sha1 in (
+                (JUNIT_URL, JUNIT_PATH, JUNIT_SIZE, JUNIT_SHA1),
+                (HAMCREST_URL, HAMCREST_PATH, HAMCREST_SIZE, HAMCREST_SHA1),
+            )
+            if not _jar_is_complete(path, size, sha1)
+        ]
+        if missing:
+            import requests  # Only needed for the one-off JAR downloads
+
+            # Both downloads share one keep-alive connection pool and run concurrently
+            with requests.Session() as session, ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(_download_jar, session, url, path, sha1) for url, path, sha1 in missing]
+                for future in futures:
+                    future.result()
+        else:
+            log.info("JUnit and Hamcrest JARs already exist.")
+
+        _deps_ok = True
+
+@functools.lru_cache(maxsize=32)
 def get_java_classpath(benchmark_dir: Path) -> str:
-    """Builds the full classpath needed for compilation and testing."""
+    """
+    Builds the full classpath needed for compilation and testing.
+    Memoized per benchmark_dir; the result only depends on the path.
+    """
     _ensure_dependencies() # Make sure JARs are downloaded
 
     main_classes = benchmark_dir / "build" / "classes" / "java" / "main"
@@ -58,20 +145,27 @@ def compile_with_gradle(benchmark_dir: Path):
     """
     log.info("Compiling .java files using Gradle...")
 
-    command = ["gradle", "build", "-x", "test", "--quiet"]
+    # Resolve gradle(.bat) ourselves so no shell is needed to find it. The
+    # flags keep a warm daemon and let it parallelize/cache work without
+    # touching the benchmark's own gradle.properties.
+    gradle = shutil.which("gradle") or "gradle"
+    command = [
+        gradle, "--daemon", "--parallel", "--configure-on-demand", "--build-cache",
+        "build", "-x", "test", "--quiet"
+    ]
 
     try:
-        result = subprocess.run(
+        # Only stderr is ever read; stdout is discarded and nothing is decoded on success
+        subprocess.run(
             command,
             cwd=benchmark_dir,
-            capture_output=True,
-            text=True,
-            check=True,
-            shell=True
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True
         )
         log.info("Gradle build successful.")
         return True
 
     except subprocess.CalledProcessError as e:
-        log.error(f"Gradle build FAILED. This is a critical error. {e.stderr}")
-        return False
\ No newline at end of file
+        log.error(f"Gradle build FAILED. This is a critical error. {e.stderr.decode('utf-8', errors='replace')}")
+        return False
@@ -1,8 +1,17 @@
+import os
+import sys
+import signal
+import locale
 import shutil
+import hashlib
+import functools
+import tempfile
+import textwrap
 import subprocess
 import logging
 from pathlib import Path
-from typing import Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple, Optional, Dict, List
 
 log = logging.getLogger(__name__)
 
@@ -13,80 +22,322 @@ FAIL_TEST = "FAIL_TEST"
 FAIL_TIMEOUT = "FAIL_TIMEOUT"
 FAIL_ERROR = "FAIL_ERROR"
 
-def run_validation(patch_code: str, bug_file_path: str, algorithm_name: str) -> Tuple[str, Optional[str]]:
+# Failures caused by the patch itself; a re-plan can address these.
+# FAIL_ERROR means the harness could not run at all, so retrying is wasted work.
+RETRYABLE = {FAIL_COMPILE, FAIL_TEST, FAIL_TIMEOUT}
+
+TEST_TIMEOUT = 60 # Seconds a single tester.py run may take
+TERMINATE_GRACE = 0.5 # Seconds between the polite and the forced kill
+ERROR_SNIPPET_CHARS = 1500 # Tail of the failing traceback handed back to the planner
+
+# Run each test in its own process group so the whole tree can be signalled
+if os.name == "nt":
+    _PROCESS_GROUP_KWARGS = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+else:
+    _PROCESS_GROUP_KWARGS = {"start_new_session": True}
+
+# Shadow copies of the benchmark go on a RAM-backed filesystem when available
+SHADOW_ROOT = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Results of patches already validated in this process, keyed by
+# (normalized patch hash, algorithm). Harness errors are never cached.
+_patch_cache: Dict[Tuple[bytes, str], Tuple[str, Optional[str]]] = {}
+
+# Private shadow copy of the benchmark owned by a ValidatorPool worker process
+_worker_shadow_dir: Optional[Path] = None
+
+
+def _patch_cache_key(patch_code: str, algorithm_name: str) -> Tuple[bytes, str]:
+    """Hashes the patch with whitespace-only differences collapsed."""
+    normalized = "\n".join(line.rstrip() for line in textwrap.dedent(patch_code).strip().splitlines())
+    return hashlib.sha256(normalized.encode("utf-8")).digest(), algorithm_name
+
+
+def prepare_shadow_benchmark(benchmark_dir: Path, parent_dir: Optional[str] = None) -> Path:
+    """
+    Copies the benchmark once into a fresh temporary directory (under
+    `parent_dir`, or SHADOW_ROOT by default) so patches can be applied and
+    tested there without touching the real files. The caller owns cleanup.
+    """
+    shadow_dir = Path(tempfile.mkdtemp(prefix="arcane_shadow_", dir=parent_dir or SHADOW_ROOT))
+    shutil.copytree(
+        benchmark_dir, shadow_dir, dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns(".git", "__pycache__")
+    )
+    log.info(f"Prepared shadow benchmark at {shadow_dir}")
+    return shadow_dir
+
+
+def run_validation(patch_code: str, bug_file_path: str, algorithm_name: str,
+                   shadow_dir: Optional[Path] = None) -> Tuple[str, Optional[str]]:
     """
     Validates a Python patch by applying it and running tester.py.
     """
     log.info(f"--- 3. EXECUTE: Validating Python patch for {algorithm_name} ---")
-    
-    original_file = Path(bug_file_path)
-    backup_file = original_file.with_suffix(".py.bak")
-    benchmark_dir = original_file.parent.parent 
+    return run_validation_batch([patch_code], bug_file_path, algorithm_name, shadow_dir)[0]
+
 
-    if not original_file.exists():
-        log.error(f"Validator error: Bug file not found at {original_file}")
-        return FAIL_ERROR, "Bug file not found"
+def run_validation_batch(patches: List[str], bug_file_path: str, algorithm_name: str,
+                         shadow_dir: Optional[Path] = None) -> List[Tuple[str, Optional[str]]]:
+    """
+    Validates several candidate patches for the same bug, in order.
+    The original bug file is read once before the first patch and restored
+    once after the last. Returns one (status, error) pair per patch.
+    With `shadow_dir` (see prepare_shadow_benchmark), patches are applied and
+    tested in that copy and the real benchmark is never modified.
+    """
+    results = [_cached_result(patch_code, algorithm_name) for patch_code in patches]
+    if all(results):
+        return results
 
     try:
-        shutil.copy(original_file, backup_file)
-        with open(original_file, "w", encoding="utf-8") as f:
-            f.write(patch_code)
+        with ValidationSession(bug_file_path, algorithm_name, shadow_dir) as session:
+            for index, patch_code in enumerate(patches):
+                if results[index] is None:
+                    results[index] = session.validate(patch_code)
+        return results
+
+    except FileNotFoundError as e:
+        log.error(f"Validator error: Bug file not found at {e.filename}")
+        return [result or (FAIL_ERROR, "Bug file not found") for result in results]
+
+    except Exception as e:
+        log.error(f"An unexpected error occurred during validation: {e}")
+        return [result or (FAIL_ERROR, str(e)) for result in results]
+
+
+class ValidationSession:
+    """
+    Validates any number of patches against one bug.
+    On entry the bug file is resolved, read into memory and opened once; each
+    `validate` call overwrites it through that descriptor (no stat, copy or
+    reopen per patch). On exit the original content is restored.
+    """
+    def __init__(self, bug_file_path: str, algorithm_name: str, shadow_dir: Optional[Path] = None):
+        self.algorithm_name = algorithm_name
+        self.original_file = Path(bug_file_path)
+        self.benchmark_dir = self.original_file.parent.parent 
+        if shadow_dir is not None:
+            self.original_file = Path(shadow_dir) / self.original_file.relative_to(self.benchmark_dir)
+            self.benchmark_dir = Path(shadow_dir)
+        self.original_bytes = None
+        self._fd = None
+
+    def __enter__(self):
+        # The bug files are a few KB: keep the original in memory instead of a .bak copy
+        self.original_bytes = self.original_file.read_bytes()
+        self._fd = os.open(self.original_file, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.close(self._fd)
+        self._fd = None
+        _restore_file(self.original_file, self.original_bytes)
+        log.info(f"Restored original file: {self.original_file.name}")
+
+    def validate(self, patch_code: str) -> Tuple[str, Optional[str]]:
+        """Writes one patch over the bug file and runs tester.py against it."""
+        cached = _cached_result(patch_code, self.algorithm_name)
+        if cached:
+            return cached
+
+        patch_bytes = patch_code.encode("utf-8")
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, patch_bytes)
+        os.ftruncate(self._fd, len(patch_bytes))
         
-        status, error = _run_python_test(benchmark_dir, algorithm_name)
+        status, error = _run_python_test(self.benchmark_dir, self.algorithm_name)
+        if status != FAIL_ERROR:
+            _patch_cache[_patch_cache_key(patch_code, self.algorithm_name)] = (status, error)
         
         log.info(f"--- EXECUTE complete. Result: {status} ---")
         return status, error
 
-    except Exception as e:
-        log.error(f"An unexpected error occurred during validation: {e}")
-        return FAIL_ERROR, str(e)
-        
-    finally:
-        if backup_file.exists():
-            shutil.move(str(backup_file), str(original_file))
-            log.info(f"Restored original file: {original_file.name}")
+
+class ValidatorPool:
+    """
+    Validates independent candidate patches for one bug in parallel.
+    Each worker process owns a private shadow copy of the benchmark (see
+    prepare_shadow_benchmark), so patches never race on the same file. All
+    shadow copies live under one temporary directory removed by `close`.
+    """
+    def __init__(self, benchmark_dir: Path, n_workers: Optional[int] = None):
+        self.n_workers = n_workers or max(1, (os.cpu_count() or 2) // 2)
+        self._shadow_parent = tempfile.TemporaryDirectory(
+            prefix="arcane_pool_", dir=SHADOW_ROOT, ignore_cleanup_errors=True
+        )
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            initializer=_init_pool_worker,
+            initargs=(str(benchmark_dir), self._shadow_parent.name)
+        )
+        log.info(f"Started validator pool with {self.n_workers} workers")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def validate_many(self, patches: List[str], bug_file_path: str,
+                      algorithm_name: str) -> List[Tuple[str, Optional[str]]]:
+        """
+        Returns one (status, error) pair per patch, in order. Patches already
+        validated in this process, and duplicates within the batch, are only
+        sent to a worker once.
+        """
+        results = [_cached_result(patch_code, algorithm_name) for patch_code in patches]
+        pending = {}
+        for index, patch_code in enumerate(patches):
+            if results[index] is None:
+                pending.setdefault(_patch_cache_key(patch_code, algorithm_name), []).append(index)
+
+        futures = {
+            key: self._executor.submit(_validate_in_worker, patches[indices[0]], bug_file_path, algorithm_name)
+            for key, indices in pending.items()
+        }
+        for key, future in futures.items():
+            try:
+                status, error = future.result()
+            except Exception as e:
+                log.error(f"Validator pool worker failed: {e}")
+                status, error = FAIL_ERROR, str(e)
+            # Workers cache in their own process; record it here for later batches
+            if status != FAIL_ERROR:
+                _patch_cache[key] = (status, error)
+            for index in pending[key]:
+                results[index] = (status, error)
+        return results
+
+    def close(self):
+        """Shuts the workers down and removes their shadow copies."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._shadow_parent.cleanup()
+
+
+def _init_pool_worker(benchmark_dir: str, shadow_parent: str):
+    """Gives a ValidatorPool worker process its own shadow benchmark."""
+    global _worker_shadow_dir
+    _worker_shadow_dir = prepare_shadow_benchmark(Path(benchmark_dir), shadow_parent)
+
+
+def _validate_in_worker(patch_code: str, bug_file_path: str, algorithm_name: str) -> Tuple[str, Optional[str]]:
+    """Validates one patch inside this worker's shadow benchmark."""
+    return run_validation(patch_code, bug_file_path, algorithm_name, _worker_shadow_dir)
+
+
+def _restore_file(path: Path, content: bytes):
+    """
+    Atomically puts `content` back at `path` via a temp file and os.replace,
+    keeping the original file's mode bits.
+    """
+    tmp_file = path.with_name(path.name + ".tmp")
+    tmp_file.write_bytes(content)
+    shutil.copymode(path, tmp_file)
+    os.replace(tmp_file, path)
+
+
+def _cached_result(patch_code: str, algorithm_name: str) -> Optional[Tuple[str, Optional[str]]]:
+    """Returns the stored result if this patch was already validated."""
+    result = _patch_cache.get(_patch_cache_key(patch_code, algorithm_name))
+    if result:
+        log.info(f"--- EXECUTE skipped: identical patch already validated. Result: {result[0]} ---")
+    return result
+
+
+@functools.lru_cache(maxsize=256)
+def _tester_command(algorithm_name: str) -> Tuple[str, ...]:
+    """
+    The tester.py command line for one algorithm, built once and reused for
+    every patch validated against it. Using our own interpreter avoids a PATH
+    lookup (and the Windows "python" app-execution alias) on every spawn.
+    -B stops it writing .pyc files: patches are written back to back into the
+    same file, and a same-size patch written within the same second would
+    otherwise pass the .pyc's mtime/size check and run the previous bytecode.
+    """
+    return (sys.executable, "-B", "tester.py", algorithm_name)
 
 
 def _run_python_test(benchmark_dir: Path, algorithm_name: str) -> Tuple[str, Optional[str]]:
     """
     Runs the QuixBugs tester.py script for a Python bug.
-    Uses subprocess.run for robust, hang-free execution.
+    Uses Popen + communicate so a timed-out run can be shut down as a tree.
     """
     log.info(f"Running Python test for {algorithm_name}...")
     
-    # Command to run the tester script
-    command = ["python", "tester.py", algorithm_name]
-    
     try:
-        # subprocess.run is the modern, hang-free way to do this.
-        # It handles the timeout and captures stdout/stderr without deadlocking.
-        result = subprocess.run(
-            command,
+        # tester.py reports failures on stderr, so stdout is discarded and
+        # nothing is decoded unless the test fails.
+        process = subprocess.Popen(
+            _tester_command(algorithm_name),
             cwd=benchmark_dir,
-            capture_output=True,
-            text=True,
-            timeout=60, # 60-second timeout
-            check=True  # Will raise CalledProcessError if returncode != 0
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            **_PROCESS_GROUP_KWARGS
         )
+    except Exception as e:
+        # A different error, like the interpreter not being found
+        log.error(f"Failed to execute tester.py: {e}")
+        return FAIL_ERROR, str(e)
 
-        # If check=True passes, the return code was 0, meaning success
-        log.info("Validation successful: Python test passed.")
-        return PASS, None
+    try:
+        _, stderr = process.communicate(timeout=TEST_TIMEOUT)
 
-    except subprocess.TimeoutExpired as e:
-        log.error("Validation failed: Test run timed out after 60 seconds.")
-        return FAIL_TIMEOUT, "Test run exceeded 60-second timeout (potential infinite loop)."
-    
-    except subprocess.CalledProcessError as e:
+    except subprocess.TimeoutExpired:
+        log.error(f"Validation failed: Test run timed out after {TEST_TIMEOUT} seconds.")
+        _terminate(process)
+        return FAIL_TIMEOUT, f"Test run exceeded {TEST_TIMEOUT}-second timeout (potential infinite loop)."
+
+    if process.returncode != 0:
         # The script ran but failed (the bug is still present or a new one was intro'd)
         log.warning("Validation failed: Python test failed.")
         
-        # tester.py prints the real bug to stderr
-        error_output = e.stderr
-        error_snippet = error_output.split("Traceback (most recent call last):")[-1].strip()
-        return FAIL_TEST, error_snippet[-1500:] # Return the clean error
-    
-    except Exception as e:
-        # A different error, like the script not being found
-        log.error(f"Failed to execute tester.py: {e}")
-        return FAIL_ERROR, str(e)
\ No newline at end of file
+        # tester.py prints the real bug to stderr. Locate the last traceback in
+        # the raw bytes and only decode the tail we actually return, the same
+        # way text=True would: locale encoding, with \r\n turned into \n.
+        error_bytes = stderr.rpartition(b"Traceback (most recent call last):")[2].strip()
+        error_bytes = error_bytes[-4 * ERROR_SNIPPET_CHARS:].replace(b"\r\n", b"\n")
+        error_snippet = error_bytes.decode(locale.getpreferredencoding(False), errors="replace")
+        return FAIL_TEST, error_snippet[-ERROR_SNIPPET_CHARS:] # Return the clean error
+
+    log.info("Validation successful: Python test passed.")
+    return PASS, None
+
+
+def _terminate(process: subprocess.Popen, grace: float = TERMINATE_GRACE):
+    """
+    Stops a test process and any children it spawned: a polite request first
+    (SIGTERM / taskkill without /F) so tests can clean up, then, after `grace`
+    seconds, a forced kill of the whole tree. The forced kill is sent even if
+    tester.py itself has exited, since a child that ignored the request would
+    otherwise keep running and hold the stderr pipe open.
+    """
+    _signal_tree(process, force=False)
+    try:
+        process.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        log.warning(f"Test process {process.pid} ignored termination. Killing it.")
+    _signal_tree(process, force=True)
+
+    # Reap the process and close its pipes, without waiting on anything that
+    # escaped the process group and still holds the pipe
+    try:
+        process.communicate(timeout=grace)
+    except subprocess.TimeoutExpired:
+        log.warning(f"Test process {process.pid} left a child holding its output. Detaching.")
+        process.stderr.close()
+        process.wait()
+
+
+def _signal_tree(process: subprocess.Popen, force: bool):
+    """Signals the process group started for `process`."""
+    try:
+        if os.name == "nt":
+            command = ["taskkill", "/T", "/PID", str(process.pid)]
+            if force:
+                command.insert(1, "/F")
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+    except ProcessLookupError:
+        pass  # Already exited